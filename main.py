@@ -2,25 +2,56 @@ import os
 import sys
 import json
 import time
+import hashlib
+import atexit
+import shutil
 import signal
+import queue
 import logging
+import sqlite3
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import subprocess
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait as futures_wait
 from pathlib import Path
-from typing import Dict, Set
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
 
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
 from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 from logging.handlers import RotatingFileHandler
 
+try:
+    import orjson
+except ImportError:  # Optional: faster parsing of legacy state files
+    orjson = None
+
 # -----------------------------
 # Config & State Management
 # -----------------------------
 
 APP_NAME = "android-auto-uploader-pc-agent"
+STATE_DB = "state.db"
+# Legacy JSON state, migrated into STATE_DB on first start
 STATE_FILE = "state.json"
+# Pending state updates are committed after this many seconds or updates, whichever comes first
+STATE_FLUSH_INTERVAL_SECONDS = 2.0
+STATE_FLUSH_BATCH = 100
+# Objects smaller than this are written straight to their final path (no .part + rename)
+SMALL_OBJECT_THRESHOLD = 1 * 1024 * 1024
+# Part size for ranged downloads; also used to recompute multipart ETags of local files
+MULTIPART_CHUNKSIZE = 16 * 1024 * 1024
+# Read size when streaming response bodies to disk (also the TransferManager io_chunksize)
+STREAM_CHUNK_SIZE = 1 * 1024 * 1024
+# AWS_CLI_SYNC=auto hands bulk syncs to the AWS CLI from this many workers up
+AWS_CLI_SYNC_MIN_WORKERS = 8
+# New objects are submitted in batches of this many, largest first (LPT scheduling)
+SUBMIT_BATCH_SIZE = 1000
+# Full listings fan out per first-level prefix when there are more than this many
+LISTING_SHARD_THRESHOLD = 8
+LISTING_SHARD_WORKERS = 8
 
 
 def get_app_base_dir() -> Path:
@@ -54,6 +85,9 @@ def load_env() -> Dict[str, str]:
         "POLL_INTERVAL_SECONDS": os.getenv("POLL_INTERVAL_SECONDS", "5").strip(),
         "DELETE_AFTER_DOWNLOAD": os.getenv("DELETE_AFTER_DOWNLOAD", "false").strip().lower(),
         "MAX_WORKERS": os.getenv("MAX_WORKERS", "4").strip(),
+        "MAX_WORKERS_CEILING": os.getenv("MAX_WORKERS_CEILING", "").strip(),
+        "FULL_RESYNC_EVERY": os.getenv("FULL_RESYNC_EVERY", "6").strip(),
+        "AWS_CLI_SYNC": os.getenv("AWS_CLI_SYNC", "auto").strip().lower(),
     }
 
     # Basic validation
@@ -69,11 +103,30 @@ def load_env() -> Dict[str, str]:
 
     cfg["DELETE_AFTER_DOWNLOAD"] = cfg["DELETE_AFTER_DOWNLOAD"] in {"1", "true", "yes", "y"}
 
+    if cfg["AWS_CLI_SYNC"] in {"1", "true", "yes", "y"}:
+        cfg["AWS_CLI_SYNC"] = "true"
+    elif cfg["AWS_CLI_SYNC"] != "auto":
+        cfg["AWS_CLI_SYNC"] = "false"
+
     try:
         cfg["MAX_WORKERS"] = max(1, int(cfg["MAX_WORKERS"]))
     except ValueError:
         cfg["MAX_WORKERS"] = 4
 
+    # Upper bound for adaptive concurrency; MAX_WORKERS is the starting point
+    try:
+        cfg["MAX_WORKERS_CEILING"] = max(cfg["MAX_WORKERS"], int(cfg["MAX_WORKERS_CEILING"]))
+    except ValueError:
+        cfg["MAX_WORKERS_CEILING"] = cfg["MAX_WORKERS"] * 4
+
+    # Polls between full listings. Incremental polls only see keys sorting after the resume
+    # marker, so a new key that sorts before it (e.g. an arbitrary phone filename) waits up to
+    # FULL_RESYNC_EVERY * POLL_INTERVAL_SECONDS; set to 1 to list everything every poll.
+    try:
+        cfg["FULL_RESYNC_EVERY"] = max(1, int(cfg["FULL_RESYNC_EVERY"]))
+    except ValueError:
+        cfg["FULL_RESYNC_EVERY"] = 6
+
     # Normalize prefix: allow empty; remove leading '/'; ensure no leading os.sep impact
     prefix = cfg.get("S3_PREFIX", "")
     if prefix.startswith("/"):
@@ -88,45 +141,155 @@ def load_env() -> Dict[str, str]:
 
 
 class StateStore:
-    """Simple JSON-based state store tracking downloaded objects by key->etag."""
+    """SQLite-backed state store tracking downloaded objects by key->etag.
+
+    The database runs in WAL mode and ``set()`` only stages a row; a background thread
+    commits pending rows in batches. It also persists ``max_key_seen``, the ``StartAfter``
+    marker for incremental listings, per ``scope`` (bucket and prefix) so that pointing the
+    agent at another bucket or prefix doesn't resume from an unrelated key.
+    """
 
-    def __init__(self, base_dir: Path):
+    def __init__(self, base_dir: Path, scope: str = ""):
         self.base_dir = base_dir
-        self.file_path = base_dir / STATE_FILE
+        self.file_path = base_dir / STATE_DB
+        self.legacy_path = base_dir / STATE_FILE
+        self._marker_name = f"max_key_seen:{scope}"
         self._lock = threading.Lock()
-        self._data: Dict[str, str] = {}
+        self._max_key_seen: Optional[str] = None
+        self._dirty = 0
+        self._dirty_cv = threading.Condition(self._lock)
+        self._closed = False
         self._load()
+        self._flusher = threading.Thread(target=self._flush_loop, name="state-flush", daemon=True)
+        self._flusher.start()
 
     def _load(self):
         ensure_dir(self.base_dir)
-        if self.file_path.exists():
-            try:
-                self._data = json.loads(self.file_path.read_text(encoding="utf-8"))
-            except Exception:
-                logging.warning("State file corrupted; starting fresh")
-                self._data = {}
+        try:
+            self._open()
+        except sqlite3.DatabaseError:
+            logging.warning("State database corrupted; starting fresh")
+            self._conn.close()
+            # Keep the broken file (and its WAL/SHM sidecars) around for inspection
+            for suffix in ("", "-wal", "-shm"):
+                path = Path(f"{self.file_path}{suffix}")
+                if path.exists():
+                    path.replace(f"{path}.corrupt")
+            self._open()
+        if self.legacy_path.exists():
+            self._migrate_legacy()
+        row = self._conn.execute("SELECT value FROM meta WHERE name=?", (self._marker_name,)).fetchone()
+        self._max_key_seen = row[0] if row else None
+
+    def _open(self):
+        self._conn = sqlite3.connect(str(self.file_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS state(key TEXT PRIMARY KEY, etag TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta(name TEXT PRIMARY KEY, value TEXT)")
+        # Catch corruption in existing pages now rather than on the first lookup
+        self._conn.execute("SELECT count(*) FROM state").fetchone()
+
+    def _migrate_legacy(self):
+        """Import a state.json written by older versions, then move it aside."""
+        try:
+            if orjson is not None:
+                raw = orjson.loads(self.legacy_path.read_bytes())
+            else:
+                raw = json.loads(self.legacy_path.read_text(encoding="utf-8"))
+            # Flat key->etag mapping
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO state(key, etag) VALUES (?, ?)", raw.items())
+            logging.info(f"Migrated {len(raw)} entries from {self.legacy_path.name}")
+        except Exception:
+            logging.warning("Legacy state file corrupted; ignoring it")
+        self.legacy_path.replace(self.legacy_path.with_suffix(".json.migrated"))
+
+    def _flush_loop(self):
+        with self._dirty_cv:
+            while not self._closed:
+                self._dirty_cv.wait_for(
+                    lambda: self._closed or self._dirty >= STATE_FLUSH_BATCH,
+                    timeout=STATE_FLUSH_INTERVAL_SECONDS,
+                )
+                self._commit_locked()
+
+    def _commit_locked(self):
+        if self._dirty:
+            self._conn.commit()
+            self._dirty = 0
 
     def save(self):
+        """Commit pending updates now."""
+        with self._lock:
+            self._commit_locked()
+
+    def close(self):
+        with self._dirty_cv:
+            if self._closed:
+                return
+            self._closed = True
+            self._dirty_cv.notify()
+        self._flusher.join()
         with self._lock:
-            tmp = self.file_path.with_suffix(".tmp")
-            tmp.write_text(json.dumps(self._data, ensure_ascii=False, indent=2), encoding="utf-8")
-            tmp.replace(self.file_path)
+            self._commit_locked()
+            self._conn.close()
+
+    @property
+    def max_key_seen(self) -> Optional[str]:
+        with self._lock:
+            return self._max_key_seen
+
+    def advance_marker(self, key: Optional[str], reset: bool = False):
+        """Move the resume marker forward to ``key``.
+
+        With ``reset`` (after a complete listing) the marker is set outright, so it can move
+        backwards when the largest keys have been deleted from the bucket.
+        """
+        with self._dirty_cv:
+            if key == self._max_key_seen:
+                return
+            if not reset and (key is None or (self._max_key_seen is not None and key < self._max_key_seen)):
+                return
+            if key is None:
+                self._conn.execute("DELETE FROM meta WHERE name=?", (self._marker_name,))
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta(name, value) VALUES (?, ?)", (self._marker_name, key)
+                )
+            self._max_key_seen = key
+            self._dirty += 1
 
     def has(self, key: str, etag: str) -> bool:
         with self._lock:
-            return self._data.get(key) == etag
+            row = self._conn.execute("SELECT 1 FROM state WHERE key=? AND etag=?", (key, etag)).fetchone()
+            return row is not None
 
     def set(self, key: str, etag: str):
-        with self._lock:
-            self._data[key] = etag
+        with self._dirty_cv:
+            self._conn.execute("INSERT OR REPLACE INTO state(key, etag) VALUES (?, ?)", (key, etag))
+            self._dirty += 1
+            if self._dirty >= STATE_FLUSH_BATCH:
+                self._dirty_cv.notify()
 
     def prune(self, keep_keys: Set[str]):
-        with self._lock:
-            removed = [k for k in self._data.keys() if k not in keep_keys]
-            for k in removed:
-                self._data.pop(k, None)
-            if removed:
-                logging.debug(f"Pruned {len(removed)} state entries not seen in listing")
+        # Snapshot committed keys on a separate WAL reader and diff them without the lock;
+        # only the deletes themselves block has()/set() on worker threads.
+        self.save()
+        reader = sqlite3.connect(str(self.file_path))
+        try:
+            current = {row[0] for row in reader.execute("SELECT key FROM state")}
+        finally:
+            reader.close()
+        stale = current - keep_keys
+        if not stale:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM state WHERE key=?", ((k,) for k in stale))
+            # Leaving the connection context commits any staged updates too
+            self._dirty = 0
+        logging.debug(f"Pruned {len(stale)} state entries not seen in listing")
 
 
 # -----------------------------
@@ -140,88 +303,532 @@ class S3Client:
             aws_secret_access_key=cfg["AWS_SECRET_ACCESS_KEY"],
             region_name=cfg["AWS_DEFAULT_REGION"],
         )
+        # A single low-level client is shared by all worker threads (clients are thread-safe);
+        # size its connection pool so concurrent downloads never wait on a free connection.
         self.client = session.client(
             "s3",
-            config=BotoConfig(retries={"max_attempts": 10, "mode": "standard"}),
+            config=BotoConfig(
+                retries={"max_attempts": 10, "mode": "adaptive"},
+                max_pool_connections=max(cfg["MAX_WORKERS_CEILING"] + cfg["MAX_WORKERS"], 50),
+                tcp_keepalive=True,
+                connect_timeout=5,
+                read_timeout=60,
+                s3={"addressing_style": "virtual", "use_accelerate_endpoint": False},
+            ),
         )
         self.bucket = cfg["S3_BUCKET"]
         self.prefix = cfg["S3_PREFIX"]
 
-    def list_objects(self):
+    def list_objects(
+        self,
+        start_after: Optional[str] = None,
+        prefix: Optional[str] = None,
+        delimiter: Optional[str] = None,
+    ) -> Iterator[Tuple[str, str, int]]:
+        """Yield (key, etag, size) for objects under ``prefix`` (defaults to the configured prefix).
+
+        When ``start_after`` is given only keys lexicographically after it are listed.
+        """
+        paginator = self.client.get_paginator("list_objects_v2")
+        kwargs = {"Bucket": self.bucket, "PaginationConfig": {"PageSize": 1000}}
+        prefix = self.prefix if prefix is None else prefix
+        if prefix:
+            kwargs["Prefix"] = prefix
+        if start_after:
+            kwargs["StartAfter"] = start_after
+        if delimiter:
+            kwargs["Delimiter"] = delimiter
+        # Project only the fields we use; empty pages project to None
+        for item in paginator.paginate(**kwargs).search("Contents[].[Key, ETag, Size]"):
+            if item is None:
+                continue
+            key, etag, size = item
+            yield key, (etag or "").strip('"'), size or 0
+
+    def list_common_prefixes(self) -> Iterator[str]:
+        """Yield the first-level "directories" directly under the configured prefix."""
         paginator = self.client.get_paginator("list_objects_v2")
-        kwargs = {"Bucket": self.bucket}
+        kwargs = {"Bucket": self.bucket, "Delimiter": "/"}
         if self.prefix:
             kwargs["Prefix"] = self.prefix
-        for page in paginator.paginate(**kwargs):
-            for obj in page.get("Contents", []):
-                yield obj
+        for item in paginator.paginate(**kwargs).search("CommonPrefixes[].Prefix"):
+            if item is not None:
+                yield item
 
-    def download_to_temp(self, key: str, tmp_path: Path):
-        ensure_dir(tmp_path.parent)
-        self.client.download_file(self.bucket, key, str(tmp_path))
+    def download_to_temp(self, key: str, tmp_path: Path, max_concurrency: int = 1):
+        """Fetch a large object as ``max_concurrency`` parallel ranged GETs.
+
+        The transfer manager is per call so its range concurrency matches the slots the
+        ConcurrencyController granted this download; large objects are few, so its thread
+        start-up is negligible next to the transfer.
+        """
+        config = TransferConfig(
+            multipart_threshold=MULTIPART_CHUNKSIZE,
+            multipart_chunksize=MULTIPART_CHUNKSIZE,
+            max_concurrency=max_concurrency,
+            max_io_queue=10000,
+            io_chunksize=STREAM_CHUNK_SIZE,
+            use_threads=True,
+        )
+        with create_transfer_manager(self.client, config) as transfer:
+            transfer.download(self.bucket, key, str(tmp_path)).result()
+
+    def download_small(self, key: str, target_path: Path):
+        """Stream a small object straight into ``target_path`` with a single GET."""
+        body = self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+        try:
+            fd = os.open(target_path, flags, 0o644)
+            try:
+                with os.fdopen(fd, "wb") as fh:
+                    shutil.copyfileobj(body, fh, length=STREAM_CHUNK_SIZE)
+            except Exception:
+                target_path.unlink()
+                raise
+        finally:
+            body.close()
 
     def delete_object(self, key: str):
         self.client.delete_object(Bucket=self.bucket, Key=key)
 
 
+# -----------------------------
+# Concurrency Control
+# -----------------------------
+
+class ConcurrencyController:
+    """AIMD admission control for concurrent S3 GET streams.
+
+    ``limit`` is the number of GETs allowed in flight: a small object takes one slot, a
+    large object as many slots as ranged GETs it runs. Throughput is measured over windows
+    of ``limit`` completed downloads. If a window saw S3 retries the limit is halved;
+    otherwise, once a baseline exists, it grows by one while throughput keeps improving by
+    at least ``GROWTH_THRESHOLD`` over its EWMA, up to ``ceiling``.
+    """
+
+    GROWTH_THRESHOLD = 1.10
+    EWMA_ALPHA = 0.3
+
+    def __init__(self, initial: int, ceiling: int):
+        self.ceiling = max(1, ceiling)
+        self.limit = max(1, min(initial, self.ceiling))
+        self._cv = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_done = 0
+        self._window_retries = 0
+        self._ewma: Optional[float] = None
+
+    def run(self, fn: Callable[..., bool], *args, size: int = 0, max_slots: int = 1) -> bool:
+        """Run ``fn`` once slots are free; a True result counts ``size`` bytes as transferred.
+
+        Up to ``max_slots`` slots are granted and passed to ``fn`` as ``slots``. While other
+        downloads are active or waiting the grant is capped at half the limit, so one large
+        object can't starve the rest; a lone download may use the whole limit.
+        """
+
+        def granted() -> int:
+            if self._active == 0 and self._waiting == 1:
+                return max(1, min(max_slots, self.limit))
+            return max(1, min(max_slots, self.limit // 2))
+
+        with self._cv:
+            self._waiting += 1
+            try:
+                self._cv.wait_for(lambda: self._active + granted() <= self.limit)
+                slots = granted()
+            finally:
+                self._waiting -= 1
+            if self._active == 0:
+                # Don't count idle time between polls against throughput
+                self._reset_window(keep_retries=True)
+            self._active += slots
+        ok = False
+        try:
+            ok = fn(*args, slots=slots)
+            return ok
+        finally:
+            with self._cv:
+                self._active -= slots
+                self._window_done += 1
+                if ok:
+                    self._window_bytes += size
+                # Retries are acted on even if the batch ends before a full window
+                if self._window_done >= self.limit or (self._active == 0 and self._window_retries):
+                    self._adjust()
+                self._cv.notify_all()
+
+    def on_after_call(self, parsed=None, **kwargs):
+        """botocore ``after-call`` hook: count requests that needed retries/throttling."""
+        attempts = (parsed or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0)
+        if attempts:
+            with self._cv:
+                self._window_retries += attempts
+
+    def _reset_window(self, keep_retries: bool = False):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_done = 0
+        if not keep_retries:
+            self._window_retries = 0
+
+    def _adjust(self):
+        elapsed = max(time.monotonic() - self._window_start, 1e-6)
+        rate = self._window_bytes / elapsed / (1024 * 1024)
+        previous = self.limit
+        if self._window_retries:
+            self.limit = max(1, self.limit // 2)
+        elif rate > 0 and self._ewma and rate >= self._ewma * self.GROWTH_THRESHOLD:
+            self.limit = min(self.ceiling, self.limit + 1)
+        # Windows that moved no bytes (only skips) say nothing about throughput
+        if rate > 0:
+            self._ewma = rate if self._ewma is None else self.EWMA_ALPHA * rate + (1 - self.EWMA_ALPHA) * self._ewma
+        if self.limit != previous:
+            logging.info(f"Download concurrency {previous} -> {self.limit} ({rate:.3g} MiB/s, {self._window_retries} retries)")
+        self._reset_window()
+
+
 # -----------------------------
 # Core Logic
 # -----------------------------
 
-def s3_key_to_local_path(key: str, prefix: str, dest_dir: Path) -> Path:
-    # Strip prefix if present
-    rel = key
-    if prefix and key.startswith(prefix):
-        rel = key[len(prefix):]
-        if rel.startswith("/"):
-            rel = rel[1:]
-    # Normalize any backslashes
-    rel = rel.replace("\\", "/")
-    # Ensure no traversal
-    rel = os.path.normpath(rel)
-    if rel.startswith(".."):
-        raise ValueError(f"Unsafe key path: {key}")
-    return dest_dir / rel
-
-
-def worker_download(s3: S3Client, state: StateStore, cfg: Dict[str, str], obj: Dict) -> bool:
-    key = obj["Key"]
-    etag = obj.get("ETag", "").strip('"')
+def make_resolver(prefix: str, dest_dir: Path) -> Callable[[str], Path]:
+    """Build a key->local path function with the prefix/destination work done once."""
+    plen = len(prefix) if prefix else 0
+    dest_str = str(dest_dir) + os.sep
+
+    def resolve(key: str) -> Path:
+        # Strip prefix if present
+        rel = key
+        if plen and key.startswith(prefix):
+            rel = key[plen:]
+            if rel.startswith("/"):
+                rel = rel[1:]
+        # Normalize any backslashes
+        rel = rel.replace("\\", "/")
+        # Ensure no traversal
+        if ".." in rel.split("/"):
+            raise ValueError(f"Unsafe key path: {key}")
+        return Path(dest_str + rel)
+
+    return resolve
+
+
+def local_etag_matches(path: Path, size: int, etag: str) -> bool:
+    """Check whether ``path`` already holds the object described by ``size``/``etag``.
+
+    Single-part ETags are the MD5 of the content. Multipart ETags ("<md5>-<parts>") are
+    the MD5 of the concatenated part MD5s, so they are recomputed for each plausible
+    part size. Other ETags (e.g. SSE-KMS) never match, which only costs a download.
+    """
+    try:
+        if path.stat().st_size != size:
+            return False
+    except OSError:
+        return False
+
+    digest, _, parts = etag.partition("-")
+    if not parts:
+        md5 = hashlib.md5()
+        with path.open("rb") as fh:
+            while chunk := fh.read(STREAM_CHUNK_SIZE):
+                md5.update(chunk)
+        return md5.hexdigest() == digest
 
+    try:
+        part_count = int(parts)
+    except ValueError:
+        return False
+    # Our own part size, the common 8 MiB default, and the MiB-rounded size implied by the count
+    implied = -(-size // part_count)
+    implied = -(-implied // (1024 * 1024)) * 1024 * 1024
+    for part_size in dict.fromkeys((MULTIPART_CHUNKSIZE, 8 * 1024 * 1024, implied)):
+        if -(-size // part_size) != part_count:
+            continue
+        part_md5s = hashlib.md5()
+        with path.open("rb") as fh:
+            while part := fh.read(part_size):
+                part_md5s.update(hashlib.md5(part).digest())
+        if part_md5s.hexdigest() == digest:
+            return True
+    return False
+
+
+class DownloadFinalizer:
+    """Single thread that finishes downloads: move ``.part`` files into place and record state.
+
+    Keeping this Python-heavy bookkeeping off the download threads lets them spend their
+    time in socket reads (which release the GIL). Batched state commits are the next
+    stage, handled by ``StateStore``'s flusher.
+    """
+
+    def __init__(self, s3: S3Client, state: StateStore):
+        self.s3 = s3
+        self.state = state
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="finalize")
+        self._lock = threading.Lock()
+        self._pending: Set[Future] = set()
+
+    def submit(self, key: str, etag: str, target_path: Path, tmp_path: Optional[Path] = None) -> Future:
+        """Queue a finished download; ``tmp_path`` is renamed to ``target_path`` if given."""
+        done = self._executor.submit(self._finalize, key, etag, target_path, tmp_path)
+        with self._lock:
+            self._pending.add(done)
+        done.add_done_callback(self._discard)
+        return done
+
+    def wait(self):
+        """Block until everything queued so far has been finalized."""
+        with self._lock:
+            pending = list(self._pending)
+        futures_wait(pending)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _discard(self, done: Future):
+        with self._lock:
+            self._pending.discard(done)
+
+    def _finalize(self, key: str, etag: str, target_path: Path, tmp_path: Optional[Path]) -> bool:
+        try:
+            if tmp_path is not None:
+                # Atomic replace
+                tmp_path.replace(target_path)
+            self.state.set(key, etag)
+            logging.info(f"Saved: s3://{self.s3.bucket}/{key} -> {target_path}")
+            return True
+        except Exception as e:
+            logging.error(f"Failed to finalize {key}: {e}")
+            try:
+                if tmp_path is not None and tmp_path.exists():
+                    tmp_path.unlink()
+            except Exception:
+                pass
+            raise
+
+
+def is_folder_marker(key: str, size: int) -> bool:
+    """Zero-byte "directory" placeholders created by the S3 console; never downloaded."""
+    return size == 0 and key.endswith("/")
+
+
+def worker_download(
+    s3: S3Client,
+    state: StateStore,
+    finalizer: DownloadFinalizer,
+    cfg: Dict[str, str],
+    key: str,
+    etag: str,
+    size: int,
+    target_path: Path,
+    slots: int = 1,
+) -> bool:
+    """Download one object to ``target_path``, whose parent directory must already exist.
+
+    Only the network transfer happens here; renaming and recording state are handed to
+    ``finalizer``. Large objects use ``slots`` parallel ranged GETs.
+    """
     if state.has(key, etag):
         logging.debug(f"Skip (already downloaded): {key}")
         return False
 
-    dest_dir = Path(cfg["DESTINATION_DIR"])    
-    target_path = s3_key_to_local_path(key, s3.prefix, dest_dir)
+    # Small objects skip the .part + rename dance; atomicity matters less than syscalls there
+    small = size < SMALL_OBJECT_THRESHOLD
     tmp_path = target_path.with_suffix(target_path.suffix + ".part")
+    downloaded = False
 
     try:
-        logging.info(f"Downloading: s3://{s3.bucket}/{key} -> {target_path}")
-        s3.download_to_temp(key, tmp_path)
-        ensure_dir(target_path.parent)
-        # Atomic replace
-        tmp_path.replace(target_path)
-        state.set(key, etag)
-        state.save()
+        # Bytes already on disk (e.g. state was lost) only need to be recorded
+        if local_etag_matches(target_path, size, etag):
+            logging.info(f"Already on disk, recording: {key}")
+            finalized = finalizer.submit(key, etag, target_path)
+        elif small:
+            s3.download_small(key, target_path)
+            finalized = finalizer.submit(key, etag, target_path)
+            downloaded = True
+        else:
+            s3.download_to_temp(key, tmp_path, max_concurrency=slots)
+            finalized = finalizer.submit(key, etag, target_path, tmp_path)
+            downloaded = True
         if cfg["DELETE_AFTER_DOWNLOAD"]:
+            # Only delete once the file is in place and recorded
+            try:
+                finalized.result()
+            except Exception:
+                return False
             try:
                 s3.delete_object(key)
                 logging.info(f"Deleted from S3 after download: {key}")
             except ClientError as e:
                 logging.warning(f"Failed to delete {key} from S3: {e}")
-        return True
+        return downloaded
     except Exception as e:
         logging.error(f"Failed to download {key}: {e}")
-        # Cleanup partial
+        # Cleanup partial (small objects clean up after themselves)
         try:
-            if tmp_path.exists():
+            if not small and tmp_path.exists():
                 tmp_path.unlink()
         except Exception:
             pass
         return False
 
 
+def find_aws_cli(cfg: Dict[str, str]) -> Optional[str]:
+    """Return the aws executable to use for bulk syncs, or None to stay on the Python path."""
+    mode = cfg["AWS_CLI_SYNC"]
+    if mode == "false":
+        return None
+    if mode == "auto" and cfg["MAX_WORKERS"] < AWS_CLI_SYNC_MIN_WORKERS:
+        return None
+    aws = shutil.which("aws")
+    reason = None
+    if not aws:
+        reason = "aws executable not found"
+    elif cfg["DELETE_AFTER_DOWNLOAD"]:
+        reason = "DELETE_AFTER_DOWNLOAD is enabled"
+    elif cfg["S3_PREFIX"] and not cfg["S3_PREFIX"].endswith("/"):
+        # aws s3 sync maps keys relative to a "directory" prefix only
+        reason = "S3_PREFIX does not end with '/'"
+    if reason:
+        if mode == "true":
+            logging.warning(f"AWS CLI sync disabled: {reason}")
+        return None
+    return aws
+
+
+def sync_with_aws_cli(
+    s3: S3Client, state: StateStore, cfg: Dict[str, str], aws: str, state_dir: Path
+) -> Optional[Tuple[Set[str], Dict[str, Tuple[str, int, Path]]]]:
+    """Bulk-download with ``aws s3 sync`` (CRT transfer client), then record ETags.
+
+    Returns the keys seen in the follow-up listing together with the objects that did not
+    land on disk (key -> (etag, size, target path)), or None if the sync failed (the caller
+    falls back to the Python download path) or was interrupted by ``stop_event``.
+    """
+    dest_dir = Path(cfg["DESTINATION_DIR"])
+    # Dedicated CLI config selecting the native CRT transfer client
+    config_file = state_dir / "aws-cli.config"
+    config_file.write_text("[default]\ns3 =\n  preferred_transfer_client = crt\n", encoding="utf-8")
+    env = dict(os.environ)
+    env.pop("AWS_PROFILE", None)
+    env.update(
+        AWS_ACCESS_KEY_ID=cfg["AWS_ACCESS_KEY_ID"],
+        AWS_SECRET_ACCESS_KEY=cfg["AWS_SECRET_ACCESS_KEY"],
+        AWS_DEFAULT_REGION=cfg["AWS_DEFAULT_REGION"],
+        AWS_CONFIG_FILE=str(config_file),
+    )
+    cmd = [
+        aws, "s3", "sync", f"s3://{s3.bucket}/{s3.prefix}", str(dest_dir),
+        "--only-show-errors", "--exclude", f"{state_dir.name}/*",
+    ]
+    logging.info(f"Syncing with AWS CLI: s3://{s3.bucket}/{s3.prefix} -> {dest_dir}")
+    # stderr goes to a file: nothing drains a pipe while we poll, and a full pipe would hang the CLI
+    log_path = state_dir / "aws-cli.log"
+    with log_path.open("w", encoding="utf-8") as log_fh:
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=log_fh)
+        # Poll so a shutdown request doesn't have to wait for a whole-bucket sync
+        while proc.poll() is None:
+            if stop_event.wait(1):
+                logging.info("Stopping AWS CLI sync...")
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+                return None
+    if proc.returncode != 0:
+        error = log_path.read_text(encoding="utf-8", errors="replace").strip()
+        logging.error(f"aws s3 sync failed ({proc.returncode}): {error[-2000:]}")
+        return None
+
+    # Re-list to record what landed on disk so incremental polls and restarts skip it. The
+    # CLI's own listing can't be reused, so this one fans out across prefixes like a full poll.
+    resolve = make_resolver(s3.prefix, dest_dir)
+    seen_keys: Set[str] = set()
+    missing: Dict[str, Tuple[str, int, Path]] = {}
+    with closing(list_objects_sharded(s3)) as listing:
+        for key, etag, size in listing:
+            seen_keys.add(key)
+            if is_folder_marker(key, size) or state.has(key, etag):
+                continue
+            try:
+                target_path = resolve(key)
+            except ValueError:
+                continue
+            if target_path == dest_dir:
+                continue
+            # Size alone can't tell an old file of the same length from the synced one
+            if local_etag_matches(target_path, size, etag):
+                state.set(key, etag)
+            else:
+                missing[key] = (etag, size, target_path)
+    # Objects that didn't land are left to the caller's retry set, so the marker can move on.
+    # This was a complete listing, so the marker is set outright.
+    state.advance_marker(max(seen_keys, default=None), reset=True)
+    return seen_keys, missing
+
+
+def list_objects_sharded(s3: S3Client) -> Iterator[Tuple[str, str, int]]:
+    """Full listing that fans out one paginator per first-level prefix.
+
+    Small buckets (few common prefixes) fall back to a single linear listing. Results
+    from the shards are merged through a bounded queue, so ordering is not preserved.
+    """
+    prefixes = list(s3.list_common_prefixes())
+    if len(prefixes) <= LISTING_SHARD_THRESHOLD:
+        yield from s3.list_objects()
+        return
+
+    # One shard for objects sitting directly under the prefix, one per common prefix
+    shards = [{"prefix": s3.prefix, "delimiter": "/"}] + [{"prefix": p} for p in prefixes]
+    results: "queue.Queue" = queue.Queue(maxsize=10000)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not cancelled.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run_shard(kwargs):
+        # Shards still queued when another failed (or the consumer stopped) skip their LIST call
+        if cancelled.is_set():
+            return
+        try:
+            for item in s3.list_objects(**kwargs):
+                if not put(item):
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    logging.debug(f"Listing {len(prefixes)} prefixes in parallel")
+    with ThreadPoolExecutor(max_workers=min(LISTING_SHARD_WORKERS, len(shards))) as pool:
+        for kwargs in shards:
+            pool.submit(run_shard, kwargs)
+        try:
+            remaining = len(shards)
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            # Unblock shards if the consumer stops early or a shard failed
+            cancelled.set()
+
+
 stop_event = threading.Event()
 
 
@@ -258,7 +865,9 @@ def main():
     # State directory under destination dir to keep alongside files
     state_dir = dest_dir / f".{APP_NAME}_state"
     ensure_dir(state_dir)
-    state = StateStore(state_dir)
+    state = StateStore(state_dir, scope=f"{cfg['S3_BUCKET']}/{cfg['S3_PREFIX']}")
+    # Flush batched state updates even if we exit abnormally
+    atexit.register(state.close)
 
     # File logging to state directory (rotating)
     try:
@@ -274,42 +883,165 @@ def main():
 
     interval = cfg["POLL_INTERVAL_SECONDS"]
     max_workers = cfg["MAX_WORKERS"]
+    max_workers_ceiling = cfg["MAX_WORKERS_CEILING"]
+    full_resync_every = cfg["FULL_RESYNC_EVERY"]
+    aws_cli = find_aws_cli(cfg)
 
     logging.info("Starting S3 polling loop...")
-    logging.info(f"Bucket={s3.bucket}, Prefix='{s3.prefix}', Dest='{dest_dir}', Interval={interval}s, Workers={max_workers}")
+    logging.info(f"Bucket={s3.bucket}, Prefix='{s3.prefix}', Dest='{dest_dir}', Interval={interval}s, Workers={max_workers} (max {max_workers_ceiling})")
+    logging.info(f"Full listing every {full_resync_every} poll(s); keys sorting before the resume marker are picked up within {full_resync_every * interval}s")
+    if aws_cli:
+        logging.info(f"Full resyncs use AWS CLI sync: {aws_cli}")
 
-    while not stop_event.is_set():
-        try:
-            objects = list(s3.list_objects())
-            # Track keys seen to prune state (optional)
-            seen_keys = {o["Key"] for o in objects}
-            state.prune(seen_keys)
-
-            # Filter objects needing download
-            to_download = []
-            for obj in objects:
-                key = obj["Key"]
-                etag = obj.get("ETag", "").strip('"')
-                if not state.has(key, etag):
-                    to_download.append(obj)
-
-            if to_download:
-                logging.info(f"Found {len(to_download)} new/updated object(s). Downloading...")
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    futures = [executor.submit(worker_download, s3, state, cfg, obj) for obj in to_download]
+    poll_count = 0
+    # Downloads that failed, keyed by S3 key; re-submitted every poll until they are recorded,
+    # even when they sort before the resume marker and an incremental listing skips them.
+    retry: Dict[str, Tuple[str, int, Path]] = {}
+    # The pool is sized for the ceiling; the controller decides how many downloads run at once
+    controller = ConcurrencyController(max_workers, max_workers_ceiling)
+    s3.client.meta.events.register("after-call.s3", controller.on_after_call)
+    # Created once and kept across polls so worker threads (and their warm connections) are reused
+    executor = ThreadPoolExecutor(max_workers=max_workers_ceiling, thread_name_prefix="dl")
+    finalizer = DownloadFinalizer(s3, state)
+    try:
+        while not stop_event.is_set():
+            try:
+                # Incremental polls only list keys after the resume marker; a periodic full
+                # resync catches out-of-order and re-uploaded objects via ETag diff.
+                full_resync = poll_count % full_resync_every == 0
+                poll_count += 1
+                start_after = None if full_resync else state.max_key_seen
+                if full_resync:
+                    logging.debug("Full resync listing")
+
+                # Bulk catch-up goes through the native CLI; incremental polls stay in Python
+                if full_resync and aws_cli:
+                    synced = sync_with_aws_cli(s3, state, cfg, aws_cli, state_dir)
+                    if stop_event.is_set():
+                        continue
+                    if synced is not None:
+                        synced_keys, missing = synced
+                        state.prune(synced_keys)
+                        # Drop retries the sync landed or whose objects are gone from S3
+                        for key, (etag, _, _) in list(retry.items()):
+                            if key not in synced_keys or state.has(key, etag):
+                                del retry[key]
+                        retry.update(missing)
+                        continue
+
+                # Submit downloads as listing pages arrive so listing and downloading overlap
+                seen_keys: Set[str] = set()
+                # Destination directories are created once per listing, not once per file
+                created_dirs: Set[Path] = set()
+                resolve = make_resolver(s3.prefix, dest_dir)
+                futures = []
+                pending = []
+                submitted = []
+                listed = False
+                listing = None
+
+                def prepare(key, etag, size, target_path) -> bool:
+                    # Per-key, so one bad path (e.g. a file where a directory should be) can't
+                    # abort the whole listing
+                    if target_path.parent in created_dirs:
+                        return True
+                    try:
+                        ensure_dir(target_path.parent)
+                    except OSError as e:
+                        logging.error(f"Failed to create directory for {key}: {e}")
+                        retry[key] = (etag, size, target_path)
+                        return False
+                    created_dirs.add(target_path.parent)
+                    return True
+
+                def submit_pending():
+                    # Largest first, so a big object picked up last doesn't dominate the tail
+                    pending.sort(key=lambda item: item[2], reverse=True)
+                    submitted.extend(pending)
+                    for item in pending:
+                        size = item[2]
+                        # Small objects are one GET; large ones one ranged GET per part
+                        ranges = 1 if size < SMALL_OBJECT_THRESHOLD else -(-size // MULTIPART_CHUNKSIZE)
+                        futures.append(
+                            executor.submit(
+                                controller.run, worker_download, s3, state, finalizer, cfg, *item, size=size, max_slots=ranges
+                            )
+                        )
+                    pending.clear()
+
+                try:
+                    # Incremental listings are small; only full ones are worth sharding
+                    listing = list_objects_sharded(s3) if full_resync else s3.list_objects(start_after=start_after)
+                    for key, etag, size in listing:
+                        seen_keys.add(key)
+                        if is_folder_marker(key, size) or state.has(key, etag):
+                            continue
+                        try:
+                            target_path = resolve(key)
+                        except ValueError as e:
+                            logging.error(str(e))
+                            continue
+                        if target_path == dest_dir:
+                            # e.g. an object named exactly like S3_PREFIX
+                            logging.debug(f"Skip (maps to destination root): {key}")
+                            continue
+                        if not prepare(key, etag, size, target_path):
+                            continue
+                        pending.append((key, etag, size, target_path))
+                        if len(pending) >= SUBMIT_BATCH_SIZE:
+                            submit_pending()
+                    listed = True
+
+                    # Listed keys were re-checked above; retry the failures this listing skipped.
+                    # A full listing that no longer sees a key means it is gone from S3.
+                    for key, (etag, size, target_path) in list(retry.items()):
+                        if key in seen_keys or full_resync:
+                            del retry[key]
+                        elif not state.has(key, etag) and prepare(key, etag, size, target_path):
+                            pending.append((key, etag, size, target_path))
+                    submit_pending()
+
+                    # Track keys seen to prune state (optional); only a full listing sees every key
+                    if full_resync:
+                        state.prune(seen_keys)
+
+                    if futures:
+                        logging.info(f"Found {len(futures)} new/updated object(s). Waiting for downloads...")
+                    else:
+                        logging.debug("No new objects.")
+                finally:
+                    # Close the listing explicitly if the loop above raised, so a sharded
+                    # listing stops its shard threads now rather than when it is collected
+                    if listing is not None:
+                        listing.close()
+                    # Drain even if listing failed midway: anything still in flight would not be
+                    # in state yet, and the next tick would download it a second time.
                     for _ in as_completed(futures):
                         pass
-            else:
-                logging.debug("No new objects.")
-        except ClientError as e:
-            logging.error(f"S3 error: {e}")
-            time.sleep(min(30, interval))
-        except Exception as e:
-            logging.error(f"Unexpected error: {e}")
-        finally:
-            # Wait for next tick
-            stop_event.wait(interval)
+                    finalizer.wait()
 
+                    for key, etag, size, target_path in submitted:
+                        if state.has(key, etag):
+                            retry.pop(key, None)
+                        else:
+                            retry[key] = (etag, size, target_path)
+                    # Failures are in the retry set, which is re-submitted every poll, so the
+                    # marker can move past them; a key that always fails can't pin it. A complete
+                    # full listing sets the marker outright.
+                    if listed:
+                        state.advance_marker(max(seen_keys, default=None), reset=full_resync)
+            except ClientError as e:
+                logging.error(f"S3 error: {e}")
+                time.sleep(min(30, interval))
+            except Exception as e:
+                logging.error(f"Unexpected error: {e}")
+            finally:
+                # Wait for next tick
+                stop_event.wait(interval)
+    finally:
+        executor.shutdown(wait=True)
+        finalizer.close()
+        state.close()
     logging.info("Exited main loop.")
 
 